@@ -1,114 +1,390 @@
 import os
-import json
 import logging
+import re
+import random
 import asyncio
-from typing import Optional, Dict, Any
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
-from azure.core.exceptions import AzureError
+import time
+import functools
+from types import MappingProxyType
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from typing import Optional
+import orjson
+import aiohttp
+from cachetools import TTLCache
+from azure.identity.aio import DefaultAzureCredential
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError, ServiceRequestError, ServiceRequestTimeoutError
+from azure.core.pipeline.policies import AsyncRetryPolicy
+from azure.core.pipeline.transport import AioHttpTransport
 import azure.functions as func
+from azure.functions.warmup import WarmUpContext
+
+logger = logging.getLogger(__name__)
 
 # Configuración desde variables de entorno
 PROJECT_ENDPOINT = os.environ.get("PROJECT_ENDPOINT")
 AGENT_ID = os.environ.get("EXISTING_AGENT_ID")
 
+# Scope del token usado por AIProjectClient (proyectos de Azure AI Foundry)
+TOKEN_SCOPE = "https://ai.azure.com/.default"
+# Margen para renovar el token antes de que expire
+TOKEN_REFRESH_MARGIN = 300
+
+# Reintentos ante errores transitorios del servicio de agentes
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+# Creación de threads, mensajes y runs (POST no idempotentes): un 500/504 pudo haberse
+# procesado en el servidor, así que no se reintenta para no duplicar el mensaje
+NON_IDEMPOTENT_RETRYABLE_STATUS_CODES = frozenset({408, 429, 502, 503})
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.25
+# Espera total máxima entre reintentos, muy por debajo del timeout de 30 s del frontend
+RETRY_MAX_TOTAL_DELAY = 5.0
+
+# Errores esperables del servicio: se registran de forma compacta, sin traceback
+EXPECTED_UPSTREAM_ERRORS = (HttpResponseError, ServiceRequestError)
+
+# Pool de conexiones HTTP hacia Azure AI Foundry (se reutiliza entre invocaciones)
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 50
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_CONNECTION_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 60
+
+# Credencial compartida por todo el worker: su caché de tokens se reutiliza entre clientes.
+# Solo quedan los métodos que se usan (variables de entorno, identidad administrada en Azure,
+# Azure CLI / azd en local); se omiten las sondas de IDEs y cachés locales
+CREDENTIAL = DefaultAzureCredential(
+    exclude_interactive_browser_credential=True,
+    exclude_visual_studio_code_credential=True,
+    exclude_shared_token_cache_credential=True,
+    exclude_powershell_credential=True
+)
+
+async def _refresh_token_loop():
+    """Mantiene caliente la caché de tokens renovando antes de la expiración"""
+    while True:
+        try:
+            token = await CREDENTIAL.get_token(TOKEN_SCOPE)
+            delay = max(token.expires_on - time.time() - TOKEN_REFRESH_MARGIN, 60)
+        except Exception as e:
+            logger.warning("Error renovando token: %s", e)
+            delay = 60
+        await asyncio.sleep(delay)
+
+_token_refresh_task = None
+
+def start_token_refresh():
+    """Lanza la tarea de renovación de token en el event loop actual (una sola vez)"""
+    global _token_refresh_task
+    if _token_refresh_task is None or _token_refresh_task.done():
+        _token_refresh_task = asyncio.get_running_loop().create_task(_refresh_token_loop())
+
+# Asociación session_id -> thread_id para reutilizar conversaciones
+SESSION_THREADS_MAX = 10_000
+SESSION_THREADS_TTL = 1800
+
+# Tiempo máximo de espera por la respuesta del agente (segundos)
+RUN_TIMEOUT = 60
+
+# Límites de entrada del proxy
+MAX_MESSAGE_LENGTH = 1000
+MAX_BATCH_SIZE = 20
+CHAT_BATCH_CONCURRENCY = int(os.environ.get("CHAT_BATCH_CONCURRENCY", "8"))
+
+def _request_not_sent(error: ServiceRequestError) -> bool:
+    """Indica si el error ocurrió antes de que la solicitud llegara a enviarse"""
+    return isinstance(error, ServiceRequestTimeoutError) or isinstance(
+        error.inner_exception, aiohttp.ClientConnectorError
+    )
+
+async def with_retry(
+    coro_factory,
+    *,
+    attempts: int = RETRY_ATTEMPTS,
+    base: float = RETRY_BASE_DELAY,
+    idempotent: bool = True,
+    max_total_delay: float = RETRY_MAX_TOTAL_DELAY
+):
+    """Ejecuta una llamada al SDK reintentando errores transitorios con backoff exponencial.
+    Si la espera pedida (o Retry-After) excede el presupuesto restante, se propaga el error"""
+    retry_statuses = RETRYABLE_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRYABLE_STATUS_CODES
+    remaining = max_total_delay
+    for attempt in range(attempts):
+        try:
+            return await coro_factory()
+        except HttpResponseError as e:
+            if e.status_code not in retry_statuses or attempt == attempts - 1:
+                raise
+            delay = base * 2 ** attempt + random.uniform(0, 0.1)
+            retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            if delay > remaining:
+                raise
+            remaining -= delay
+            logger.warning("Error transitorio %s, reintento %d en %.2fs", e.status_code, attempt + 1, delay)
+            await asyncio.sleep(delay)
+        except ServiceRequestError as e:
+            # Los POST solo se reintentan si la solicitud seguro no salió (timeout o fallo al
+            # conectar); un socket keep-alive cortado pudo cerrarse con la solicitud ya enviada
+            delay = base * 2 ** attempt + random.uniform(0, 0.1)
+            if not (idempotent or _request_not_sent(e)) or attempt == attempts - 1 or delay > remaining:
+                raise
+            remaining -= delay
+            logger.warning("Error de conexión (%s), reintento %d en %.2fs", e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+
+# Consultas triviales que se responden sin llamar al agente
+TRIVIAL_QUERY_RE = re.compile(r'^(hi|hola|gracias)\W*$', re.IGNORECASE)
+CANNED_GREETING = "¡Hola! ¿En qué puedo ayudarte con AFP Prima?"
+CANNED_THANKS = "¡De nada! ¿Hay algo más en lo que pueda ayudarte?"
+CANNED_UNCLEAR = "No entendí tu consulta. ¿Podrías darme más detalles?"
+
+def _is_trivial(query: str, in_conversation: bool = False) -> Optional[str]:
+    """Devuelve una respuesta predefinida si la consulta no requiere al agente.
+    Dentro de una conversación todo va al agente: "ok", "sí" o "35" pueden ser respuestas"""
+    if in_conversation:
+        return None
+    query = query.strip()
+    match = TRIVIAL_QUERY_RE.match(query)
+    if match:
+        return CANNED_THANKS if match.group(1).lower() == "gracias" else CANNED_GREETING
+    if len(query) < 3 or query.isdigit():
+        return CANNED_UNCLEAR
+    return None
+
+@dataclass(slots=True)
+class AgentResponse:
+    """Respuesta del agente con los mismos campos que consume el frontend"""
+    success: bool
+    content: Optional[str] = None
+    thread_id: Optional[str] = None
+    run_id: Optional[str] = None
+    error: Optional[str] = None
+
+# Cierres de sesiones HTTP en curso (se guarda la referencia hasta que terminan)
+_closing_tasks = set()
+
 class AgentProxyClient:
-    def __init__(self):
+    def __init__(self, credential=CREDENTIAL):
         """Inicializar cliente del agente con autenticación segura"""
+        # Import diferido: el SDK de proyectos solo se carga al crear el primer cliente,
+        # así los cold starts de /health y OPTIONS no pagan su import
+        from azure.ai.projects.aio import AIProjectClient
+        import azure.ai.agents.models as agent_models
+
         try:
-            self.credential = DefaultAzureCredential()
+            self.credential = credential
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=HTTP_POOL_LIMIT,
+                    limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                    keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+                )
+            )
             self.project_client = AIProjectClient(
                 credential=self.credential,
-                endpoint=PROJECT_ENDPOINT
+                endpoint=PROJECT_ENDPOINT,
+                transport=AioHttpTransport(
+                    session=self.http_session,
+                    session_owner=False,
+                    connection_timeout=HTTP_CONNECTION_TIMEOUT,
+                    read_timeout=HTTP_READ_TIMEOUT
+                ),
+                # Los reintentos los maneja with_retry; así no se anidan con los del SDK
+                retry_policy=AsyncRetryPolicy(retry_total=0)
             )
             self.agent_id = AGENT_ID
-            self.threads_cache = {}
-            logging.info(f"Cliente inicializado para agente: {self.agent_id}")
+            self.models = agent_models
+            # Métodos del SDK resueltos una sola vez para el camino caliente del chat
+            agents = self.project_client.agents
+            self._threads_create = agents.threads.create
+            self._messages_create = agents.messages.create
+            self._runs_stream = agents.runs.stream
+            self.session_threads = TTLCache(maxsize=SESSION_THREADS_MAX, ttl=SESSION_THREADS_TTL)
+            logger.info("Cliente inicializado para agente: %s", self.agent_id)
         except Exception as e:
-            logging.error(f"Error inicializando cliente: {str(e)}")
+            logger.error("Error inicializando cliente: %s", e)
+            session = getattr(self, "http_session", None)
+            if session is not None:
+                # __init__ es síncrono: el cierre se completa en el event loop del worker
+                task = asyncio.get_running_loop().create_task(session.close())
+                _closing_tasks.add(task)
+                task.add_done_callback(_closing_tasks.discard)
             raise
 
-    async def chat_with_agent(self, message: str, thread_id: Optional[str] = None) -> Dict[str, Any]:
+    async def chat_with_agent(
+        self,
+        message: str,
+        thread_id: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> AgentResponse:
         """Envía mensaje al agente usando la API correcta de Azure AI Foundry"""
         try:
-            # Crear o recuperar thread
-            if thread_id and thread_id in self.threads_cache:
-                thread = self.threads_cache[thread_id]
-                logging.info(f"Usando thread existente: {thread.id}")
-            else:
-                thread = self.project_client.agents.create_thread()
-                if thread_id:
-                    self.threads_cache[thread_id] = thread
-                logging.info(f"Nuevo thread creado: {thread.id}")
-
-            # Crear mensaje del usuario
-            message_obj = self.project_client.agents.create_message(
-                thread_id=thread.id,
-                role="user",
-                content=message
-            )
+            # Reutilizar el thread del cliente o el asociado a su sesión
+            if not thread_id and session_id:
+                thread_id = self.session_threads.get(session_id)
 
-            # Ejecutar el agente
-            run = self.project_client.agents.create_run(
-                thread_id=thread.id,
-                agent_id=self.agent_id
-            )
+            if thread_id:
+                logger.debug("Usando thread existente: %s", thread_id)
+                # Crear mensaje del usuario
+                try:
+                    await with_retry(lambda: self._messages_create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=message
+                    ), idempotent=False)
+                except ResourceNotFoundError:
+                    # Thread vencido o eliminado: se continúa en uno nuevo
+                    logger.warning("Thread %s no encontrado, se crea uno nuevo", thread_id)
+                    thread_id = None
 
-            # Esperar respuesta
-            response_content = await self._wait_for_completion(thread.id, run.id)
+            if not thread_id:
+                # Thread nuevo con el mensaje incluido: una llamada en vez de dos en cadena
+                thread = await with_retry(lambda: self._threads_create(
+                    messages=[self.models.ThreadMessageOptions(role="user", content=message)]
+                ), idempotent=False)
+                thread_id = thread.id
+                logger.debug("Nuevo thread creado: %s", thread_id)
 
-            return {
-                "success": True,
-                "content": response_content,
-                "thread_id": thread.id,
-                "run_id": run.id
-            }
+            if session_id:
+                self.session_threads[session_id] = thread_id
 
-        except Exception as e:
-            logging.error(f"Error en chat: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-
-    async def _wait_for_completion(self, thread_id: str, run_id: str, max_wait: int = 60) -> str:
-        """Espera a que el agente complete la ejecución"""
-        wait_time = 0
-        check_interval = 2
-
-        while wait_time < max_wait:
+            # Ejecutar el agente recibiendo la respuesta por streaming (sin sondeos)
+            run_state = {"run_id": None}
             try:
-                run = self.project_client.agents.get_run(thread_id=thread_id, run_id=run_id)
-                
-                if run.status == "completed":
-                    messages = self.project_client.agents.list_messages(thread_id=thread_id)
-                    for message in messages.data:
-                        if message.role == "assistant":
-                            return message.content[0].text.value
-                    return "Respuesta recibida sin contenido."
-
-                elif run.status in ["failed", "expired", "cancelled"]:
-                    raise Exception(f"Run falló con estado: {run.status}")
-
-                await asyncio.sleep(check_interval)
-                wait_time += check_interval
-
-            except Exception as e:
-                logging.error(f"Error verificando estado: {str(e)}")
-                raise
+                response_content = await asyncio.wait_for(
+                    self._run_streaming(thread_id, run_state), timeout=RUN_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.error("Timeout esperando respuesta (%ss)", RUN_TIMEOUT)
+                # El run sigue activo en el servidor y bloquearía el próximo mensaje del thread
+                await self._cancel_run(thread_id, run_state["run_id"])
+                return AgentResponse(
+                    success=False,
+                    error=f"Timeout esperando respuesta ({RUN_TIMEOUT}s)",
+                    thread_id=thread_id
+                )
+
+            return AgentResponse(
+                success=True,
+                content=response_content,
+                thread_id=thread_id,
+                run_id=run_state["run_id"]
+            )
+
+        except EXPECTED_UPSTREAM_ERRORS as e:
+            logger.warning("Error del servicio de agentes: %s: %.200s", type(e).__name__, e)
+            return AgentResponse(success=False, error=str(e))
 
-        raise Exception(f"Timeout esperando respuesta ({max_wait}s)")
+        except Exception as e:
+            logger.error("Error en chat: %s", e, exc_info=True)
+            return AgentResponse(success=False, error=str(e))
+
+    async def _run_streaming(self, thread_id: str, run_state: dict) -> str:
+        """Ejecuta el agente en modo stream y acumula los fragmentos de texto a medida que llegan.
+        Guarda el id del run en run_state para poder cancelarlo si se agota el tiempo"""
+        models = self.models
+        chunks = []
+        stream = await with_retry(lambda: self._runs_stream(
+            thread_id=thread_id,
+            agent_id=self.agent_id
+        ), idempotent=False)
+        async with stream as event_handler:
+            async for event_type, event_data, _ in event_handler:
+                if isinstance(event_data, models.MessageDeltaChunk):
+                    chunks.append(event_data.text)
+                elif isinstance(event_data, models.ThreadRun):
+                    run_state["run_id"] = event_data.id
+                    if event_data.status in ("failed", "expired", "cancelled"):
+                        raise Exception(f"Run falló con estado: {event_data.status}")
+                elif event_type == models.AgentStreamEvent.ERROR:
+                    raise Exception(f"Error en el stream del agente: {event_data}")
+
+        return "".join(chunks) or "Respuesta recibida sin contenido."
+
+    async def _cancel_run(self, thread_id: str, run_id: Optional[str]):
+        """Cancela un run que quedó activo; los errores solo se registran"""
+        if not run_id:
+            return
+        try:
+            await self.project_client.agents.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except Exception as e:
+            logger.warning("No se pudo cancelar el run %s: %s", run_id, e)
 
-# Instancia global del cliente
+# Instancia global del cliente. Vive lo mismo que el proceso del worker, igual que la
+# credencial, la sesión HTTP y la tarea de renovación de token: no se cierran al apagar,
+# porque el event loop del worker que los creó ya no está disponible en ese momento
 agent_client = None
+_agent_client_lock = asyncio.Lock()
 
-def get_agent_client():
-    """Singleton para el cliente del agente"""
+async def get_agent_client():
+    """Singleton para el cliente del agente, creado dentro del event loop del worker"""
     global agent_client
     if agent_client is None:
-        agent_client = AgentProxyClient()
+        async with _agent_client_lock:
+            if agent_client is None:
+                agent_client = AgentProxyClient()
+                start_token_refresh()
     return agent_client
 
+# Caché del sondeo profundo al agente usado por /health?deep=1
+HEALTH_TTL = 30
+_health_cache = {"ts": 0.0, "ok": False, "error": None}
+
+async def probe_agent() -> dict:
+    """Verifica que el agente responda, como máximo una vez cada HEALTH_TTL segundos"""
+    now = time.monotonic()
+    if _health_cache["ts"] and now - _health_cache["ts"] < HEALTH_TTL:
+        return _health_cache
+    try:
+        client = await get_agent_client()
+        await client.project_client.agents.get_agent(AGENT_ID)
+        _health_cache.update(ts=now, ok=True, error=None)
+    except Exception as e:
+        logger.warning("Sondeo de salud al agente falló: %s", e)
+        _health_cache.update(ts=now, ok=False, error=str(e))
+    return _health_cache
+
+_warm_up_task = None
+
+def start_warm_up():
+    """Precalienta en segundo plano el cliente, el token y la conexión TLS al agente"""
+    global _warm_up_task
+    if agent_client is None and _warm_up_task is None:
+        _warm_up_task = asyncio.get_running_loop().create_task(probe_agent())
+
+# Headers CORS y cuerpos de error constantes, serializados una sola vez
+CORS_HEADERS = MappingProxyType({
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Content-Type': 'application/json'
+})
+
+# Respuesta JSON con los headers CORS compartidos
+json_response = functools.partial(func.HttpResponse, headers=CORS_HEADERS, mimetype="application/json")
+
+ERR_BODY_REQUIRED = orjson.dumps({"error": "Body JSON requerido"})
+ERR_MESSAGE_REQUIRED = orjson.dumps({"error": "Mensaje requerido"})
+ERR_INVALID_IDS = orjson.dumps({"error": "thread_id y session_id deben ser texto"})
+ERR_MESSAGE_TOO_LONG = orjson.dumps({"error": "Mensaje demasiado largo"})
+ERR_MESSAGES_REQUIRED = orjson.dumps({"error": "Lista de mensajes requerida"})
+ERR_BATCH_TOO_LARGE = orjson.dumps({"error": f"Máximo {MAX_BATCH_SIZE} mensajes por lote"})
+ERR_INTERNAL = orjson.dumps({"success": False, "error": "Error interno del servidor"})
+
+# Respuesta de preflight CORS: es constante, se construye una sola vez
+CORS_PREFLIGHT_HEADERS = MappingProxyType({
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Access-Control-Max-Age': '3600'
+})
+OPTIONS_RESPONSE = func.HttpResponse("", status_code=200, headers=CORS_PREFLIGHT_HEADERS)
+
 # Azure Function App
 app = func.FunctionApp()
 
@@ -117,108 +393,162 @@ app = func.FunctionApp()
 async def chat_proxy(req: func.HttpRequest) -> func.HttpResponse:
     """Endpoint HTTP que hace de proxy entre el frontend y Azure AI Foundry Agents"""
     
-    # Headers CORS
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        'Content-Type': 'application/json'
-    }
-    
     try:
-        req_body = req.get_json()
-        
-        if not req_body:
-            return func.HttpResponse(
-                json.dumps({"error": "Body JSON requerido"}),
-                status_code=400,
-                headers=headers,
-                mimetype="application/json"
-            )
+        try:
+            req_body = orjson.loads(req.get_body())
+        except orjson.JSONDecodeError:
+            req_body = None
+
+        if not isinstance(req_body, dict) or not req_body:
+            return json_response(ERR_BODY_REQUIRED, status_code=400)
 
-        message = req_body.get('message', '').strip()
+        message = req_body.get('message')
+        message = message.strip() if isinstance(message, str) else ""
         thread_id = req_body.get('thread_id')
+        session_id = req_body.get('session_id')
 
         if not message:
-            return func.HttpResponse(
-                json.dumps({"error": "Mensaje requerido"}),
-                status_code=400,
-                headers=headers,
-                mimetype="application/json"
-            )
+            return json_response(ERR_MESSAGE_REQUIRED, status_code=400)
 
-        if len(message) > 1000:
-            return func.HttpResponse(
-                json.dumps({"error": "Mensaje demasiado largo"}),
-                status_code=400,
-                headers=headers,
-                mimetype="application/json"
-            )
+        if not all(v is None or isinstance(v, str) for v in (thread_id, session_id)):
+            return json_response(ERR_INVALID_IDS, status_code=400)
 
-        # Obtener cliente y enviar mensaje
-        client = get_agent_client()
-        response = await client.chat_with_agent(message, thread_id)
-
-        return func.HttpResponse(
-            json.dumps(response, ensure_ascii=False),
-            status_code=200,
-            headers=headers,
-            mimetype="application/json"
+        if len(message) > MAX_MESSAGE_LENGTH:
+            return json_response(ERR_MESSAGE_TOO_LONG, status_code=400)
+
+        in_conversation = bool(thread_id) or bool(
+            session_id and agent_client is not None and session_id in agent_client.session_threads
         )
+        canned = _is_trivial(message, in_conversation)
+        if canned:
+            canned_response = AgentResponse(success=True, content=canned, thread_id=thread_id)
+            return json_response(orjson.dumps(canned_response), status_code=200)
+
+        # Obtener cliente y enviar mensaje
+        client = await get_agent_client()
+        response = await client.chat_with_agent(message, thread_id, session_id)
+
+        return json_response(orjson.dumps(response), status_code=200)
 
     except Exception as e:
-        logging.error(f"Error en chat_proxy: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({
-                "success": False,
-                "error": "Error interno del servidor"
-            }),
-            status_code=500,
-            headers=headers,
-            mimetype="application/json"
-        )
+        logger.error("Error en chat_proxy: %s", e, exc_info=True)
+        return json_response(ERR_INTERNAL, status_code=500)
 
-@app.function_name(name="HealthCheck")
-@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
-def health_check(req: func.HttpRequest) -> func.HttpResponse:
-    """Endpoint de verificación de salud"""
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Content-Type': 'application/json'
-    }
-    
+@app.function_name(name="ChatBatch")
+@app.route(route="chat/batch", methods=["POST"], auth_level=func.AuthLevel.FUNCTION)
+async def chat_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """Procesa varios mensajes en paralelo, cada uno en su propio thread"""
+    try:
+        try:
+            req_body = orjson.loads(req.get_body())
+        except orjson.JSONDecodeError:
+            req_body = None
+        messages = req_body.get('messages') if isinstance(req_body, dict) else None
+
+        if not isinstance(messages, list) or not messages:
+            return json_response(ERR_MESSAGES_REQUIRED, status_code=400)
+
+        if len(messages) > MAX_BATCH_SIZE:
+            return json_response(ERR_BATCH_TOO_LARGE, status_code=400)
+
+        client = await get_agent_client()
+        semaphore = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+
+        async def one(message) -> AgentResponse:
+            message = message.strip() if isinstance(message, str) else ""
+            if not message:
+                return AgentResponse(success=False, error="Mensaje requerido")
+            if len(message) > MAX_MESSAGE_LENGTH:
+                return AgentResponse(success=False, error="Mensaje demasiado largo")
+            canned = _is_trivial(message)
+            if canned:
+                return AgentResponse(success=True, content=canned)
+            async with semaphore:
+                return await client.chat_with_agent(message)
+
+        results = await asyncio.gather(*(one(m) for m in messages), return_exceptions=True)
+        responses = [
+            AgentResponse(success=False, error=str(r)) if isinstance(r, BaseException) else r
+            for r in results
+        ]
+
+        return json_response(orjson.dumps({"responses": responses}), status_code=200)
+
+    except Exception as e:
+        logger.error("Error en chat_batch: %s", e, exc_info=True)
+        return json_response(ERR_INTERNAL, status_code=500)
+
+@app.warm_up_trigger(arg_name="warmupContext")
+async def warmup(warmupContext: WarmUpContext) -> None:
+    """Prepara cliente, token y conexión al agente en instancias pre-calentadas (planes Premium)"""
+    # Cada proceso del worker (FUNCTIONS_WORKER_PROCESS_COUNT) mantiene su propio cliente;
+    # al ser todo async, un único proceso suele bastar por instancia
+    await probe_agent()
+
+# Parte invariante del estado de salud, serializada una sola vez
+HEALTH_STATIC_BODY = orjson.dumps({
+    "service": "AFP Prima Chat Proxy",
+    "agent_id": AGENT_ID
+})
+
+@functools.lru_cache(maxsize=1)
+def iso_now(bucket: int) -> str:
+    """Timestamp ISO en UTC con resolución de segundos, cacheado por segundo"""
+    return datetime.fromtimestamp(bucket, timezone.utc).isoformat()
+
+def health_body(dynamic: dict) -> bytes:
+    """Une la parte dinámica del estado de salud con la parte estática preserializada"""
+    return orjson.dumps(dynamic)[:-1] + b"," + HEALTH_STATIC_BODY[1:]
+
+async def build_health_response(deep: bool, warm_up: bool = False) -> func.HttpResponse:
+    """Arma la respuesta de salud; solo consulta al agente si deep es True.
+    Con warm_up lanza en segundo plano la preparación del cliente"""
     try:
         health_status = {
             "status": "healthy",
-            "service": "AFP Prima Chat Proxy",
-            "agent_id": AGENT_ID,
-            "timestamp": func.datetime.utcnow().isoformat()
+            "timestamp": iso_now(int(time.time())),
+            "client_initialized": agent_client is not None
         }
+        status_code = 200
 
-        return func.HttpResponse(
-            json.dumps(health_status),
-            status_code=200,
-            headers=headers,
-            mimetype="application/json"
-        )
+        if deep:
+            probe = await probe_agent()
+            health_status["agent_reachable"] = probe["ok"]
+            if not probe["ok"]:
+                health_status["status"] = "unhealthy"
+                health_status["error"] = probe["error"]
+                status_code = 503
+        elif warm_up:
+            start_warm_up()
+
+        return json_response(health_body(health_status), status_code=status_code)
 
     except Exception as e:
-        return func.HttpResponse(
-            json.dumps({"status": "unhealthy", "error": str(e)}),
-            status_code=503,
-            headers=headers,
-            mimetype="application/json"
-        )
+        return json_response(orjson.dumps({"status": "unhealthy", "error": str(e)}), status_code=503)
+
+@app.function_name(name="HealthCheck")
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_check(req: func.HttpRequest) -> func.HttpResponse:
+    """Endpoint de verificación de salud; con ?deep=1 sondea también al agente.
+    El frontend lo consulta al cargar, así que además precalienta el cliente
+    antes del primer mensaje del usuario"""
+    deep = req.params.get("deep") == "1"
+    return await build_health_response(deep=deep, warm_up=not deep)
+
+@app.function_name(name="HealthLive")
+@app.route(route="health/live", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_live(req: func.HttpRequest) -> func.HttpResponse:
+    """Liveness: solo el estado del proceso, nunca llama a dependencias externas"""
+    return await build_health_response(deep=False)
+
+@app.function_name(name="HealthReady")
+@app.route(route="health/ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_ready(req: func.HttpRequest) -> func.HttpResponse:
+    """Readiness: incluye el sondeo cacheado al agente"""
+    return await build_health_response(deep=True)
 
 @app.function_name(name="Options")
 @app.route(route="{*route}", methods=["OPTIONS"], auth_level=func.AuthLevel.ANONYMOUS)
 def options_handler(req: func.HttpRequest) -> func.HttpResponse:
     """Manejar requests OPTIONS para CORS"""
-    headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        'Access-Control-Max-Age': '3600'
-    }
-    
-    return func.HttpResponse("", status_code=200, headers=headers)
\ No newline at end of file
+    return OPTIONS_RESPONSE
\ No newline at end of file
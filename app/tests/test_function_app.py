@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from azure.ai.agents import models
+from azure.ai.agents.models import AsyncAgentRunStream
+
+from function_app import AgentProxyClient
+
+def sse_event(event: str, data: dict) -> bytes:
+    """Evento server-sent tal como lo emite el servicio de agentes"""
+    return f"event: {event}\ndata: ".encode() + orjson.dumps(data) + b"\n\n"
+
+def run_event(event: str, status: str) -> bytes:
+    return sse_event(event, {"id": "run_1", "object": "thread.run", "thread_id": "thread_1", "status": status})
+
+def delta_event(text: str) -> bytes:
+    return sse_event("thread.message.delta", {
+        "id": "msg_1",
+        "object": "thread.message.delta",
+        "delta": {"role": "assistant", "content": [{"index": 0, "type": "text", "text": {"value": text}}]}
+    })
+
+async def byte_stream(events):
+    for event in events:
+        yield event
+
+def fake_client(events):
+    """Cliente con el mismo stream que devuelve agents.runs.stream, sin red"""
+    async def runs_stream(**kwargs):
+        async def submit_tool_outputs(*args, **kwargs):
+            return None
+        return AsyncAgentRunStream(byte_stream(events), submit_tool_outputs, models.AsyncAgentEventHandler())
+    return SimpleNamespace(models=models, agent_id="asst_1", _runs_stream=runs_stream)
+
+def run_streaming(events):
+    run_state = {"run_id": None}
+    content = asyncio.run(AgentProxyClient._run_streaming(fake_client(events), "thread_1", run_state))
+    return content, run_state
+
+def test_run_streaming_joins_message_deltas():
+    content, run_state = run_streaming([
+        run_event("thread.run.created", "queued"),
+        delta_event("Hola, "),
+        delta_event("¿en qué te ayudo?"),
+        run_event("thread.run.completed", "completed"),
+        b"event: done\ndata: [DONE]\n\n"
+    ])
+    assert content == "Hola, ¿en qué te ayudo?"
+    assert run_state["run_id"] == "run_1"
+
+def test_run_streaming_raises_on_failed_run():
+    with pytest.raises(Exception, match="(?i)failed"):
+        run_streaming([run_event("thread.run.failed", "failed")])